@@ -19,6 +19,26 @@ class Globals:
     # time to wait for send/receive operations
     kTimeout = timedelta(milliseconds=10)
 
+    # max amount of bytes accepted but not yet acknowledged in non-blocking mode
+    kSendBufferSize = 16 * kDataSize
+
+    # is sending paced?
+    kPacing = False
+    # max pacing rate in bytes per second (None to pace by estimate only)
+    kPacingRate = None
+    # max amount of bytes that can be sent back-to-back
+    kPacingBurst = 2 * kBatchSize
+    # pacing deficits shorter than this are not waited for
+    kPacingQuantum = timedelta(milliseconds=1)
+    # pacing rate multiplier over the delivery rate estimate
+    kPacingGain = 1.25
+    # min amount of bytes in flight for delivery rate sample to count
+    kPacingMinInFlight = 2 * kBatchSize
+    # min duration of delivery rate sample
+    kPacingSampleInterval = timedelta(milliseconds=10)
+    # how long the max delivery rate estimate is kept
+    kPacingWindow = timedelta(seconds=1)
+
     # TCP flag bits (!DO NOT MODIFY!)
     kTCPFlagBits = {
         "MSG": 0,   # There is no MSG flag in TCP, but it is for better understanding and logging
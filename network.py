@@ -0,0 +1,28 @@
+import os
+import random
+
+used_ports = {}
+
+
+def generate_port():
+    while True:
+        port = random.randrange(25000, 30000)
+        if port not in used_ports:
+            break
+    used_ports[port] = True
+    return port
+
+
+current_netem_state = None
+
+
+def setup_netem(packet_loss, duplicate, reorder):
+    global current_netem_state
+    if current_netem_state == (packet_loss, duplicate, reorder):
+        return
+    current_netem_state = (packet_loss, duplicate, reorder)
+    netem_cmd = f"tc qdisc replace dev lo root netem loss {packet_loss * 100}% duplicate {duplicate * 100}%"
+    if reorder > 0:
+        netem_cmd += f" reorder {100 - reorder}% delay 10ms"
+
+    os.system(netem_cmd)
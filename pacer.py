@@ -0,0 +1,169 @@
+from globals import Globals
+import time
+
+
+class Pacer:
+    """
+        Class for pacing batches with a token bucket
+    """
+
+    def __init__(self, rate=None, burst=None, enabled=None):
+        """
+            Construct a pacer
+
+            `rate`: (int) max pacing rate in bytes per second (Globals.kPacingRate by default)
+            `burst`: (int) max amount of bytes that can be sent back-to-back
+                (Globals.kPacingBurst by default)
+            `enabled`: (bool) is pacing enabled (Globals.kPacing by default)
+
+            If the resulting rate is None, batches are paced by the delivery rate
+            estimate only and are not paced at all until the first estimate
+        """
+
+        # is pacing enabled?
+        self.enabled = Globals.kPacing if enabled is None else enabled
+        # max pacing rate
+        self.rate = Globals.kPacingRate if rate is None else rate
+        # size of the bucket
+        self.burst = Globals.kPacingBurst if burst is None else burst
+
+        self.__tokens = self.burst              # bytes that can be sent at the last refill
+        self.__last_ns = time.monotonic_ns()    # time of the last refill
+
+        self.__estimate = None                  # max delivery rate seen in the window
+        self.__estimate_ns = self.__last_ns     # time when the estimate was taken
+        self.__delivered = 0                    # bytes acknowledged in current sample
+        self.__sample_ns = self.__last_ns       # time when current sample started
+        self.__app_limited = False              # had sender no data in current sample?
+
+    def __isExpired(self, now_ns):
+        """
+            Check if the estimate is older than Globals.kPacingWindow
+
+            `now_ns`: (int) current time in nanoseconds
+
+            `return`: (bool) True if the estimate is expired
+        """
+
+        return now_ns - self.__estimate_ns > Globals.kPacingWindow.total_seconds() * 1e9
+
+    def getRate(self):
+        """
+            Get current pacing rate
+
+            `return`: (float) pacing rate in bytes per second (None if batches are not paced)
+        """
+
+        if not self.enabled:
+            return None
+
+        # expired estimate is not used, so the rate can grow back to the cap
+        if self.__estimate is None or self.__isExpired(time.monotonic_ns()):
+            return self.rate
+
+        kEstimatedRate = Globals.kPacingGain * self.__estimate
+        return kEstimatedRate if self.rate is None else min(self.rate, kEstimatedRate)
+
+    def __tokensAt(self, now_ns, rate):
+        """
+            Get amount of tokens in the bucket at the given time
+
+            `now_ns`: (int) time in nanoseconds
+            `rate`: (float) pacing rate in bytes per second
+
+            `return`: (float) amount of tokens
+        """
+
+        return min(self.burst, self.__tokens + (now_ns - self.__last_ns) * rate / 1e9)
+
+    def delay(self, size):
+        """
+            Get time to wait before sending `size` bytes. Deficits shorter than
+            Globals.kPacingQuantum are not waited for, so segments are sent
+            in small batches instead of sleeping between each of them.
+            Does not change the state of the pacer
+
+            `size`: (int) amount of bytes to send
+
+            `return`: (float) time to wait in seconds (0 if can send now)
+        """
+
+        kRate = self.getRate()
+        if kRate is None:
+            return 0
+
+        kDeficit = min(size, self.burst) - self.__tokensAt(time.monotonic_ns(), kRate)
+        if kDeficit <= kRate * Globals.kPacingQuantum.total_seconds():
+            return 0
+
+        return kDeficit / kRate
+
+    def consume(self, size):
+        """
+            Take tokens for sent bytes (bucket may go into debt)
+
+            `size`: (int) amount of bytes sent
+        """
+
+        kRate = self.getRate()
+        if kRate is None:
+            return
+
+        now_ns = time.monotonic_ns()
+        self.__tokens = self.__tokensAt(now_ns, kRate) - size
+        self.__last_ns = now_ns
+
+    def wait(self, size):
+        """
+            Sleep until `size` bytes can be sent. Tokens are taken with consume()
+            when the bytes are actually sent
+
+            `size`: (int) amount of bytes to send
+        """
+
+        kDelay = self.delay(size)
+        if kDelay > 0:
+            time.sleep(kDelay)
+
+    def markAppLimited(self):
+        """
+            Mark current delivery rate sample as limited by the application
+            (there was no data to send), so it is not used for the estimate
+        """
+
+        self.__app_limited = True
+
+    def onAck(self, acked_size, in_flight):
+        """
+            Update delivery rate estimate with acknowledged bytes. Samples
+            limited by the pacer are used, so the estimate can grow by
+            Globals.kPacingGain each time
+
+            `acked_size`: (int) amount of newly acknowledged bytes
+            `in_flight`: (int) amount of bytes that were not acknowledged before the ACK
+        """
+
+        now_ns = time.monotonic_ns()
+
+        # sender did not fill the channel or had no data to send,
+        # sample says nothing about channel capacity
+        if in_flight < Globals.kPacingMinInFlight or self.__app_limited:
+            self.__delivered = 0
+            self.__sample_ns = now_ns
+            self.__app_limited = False
+            return
+
+        self.__delivered += acked_size
+
+        kElapsedNs = now_ns - self.__sample_ns
+        if kElapsedNs < Globals.kPacingSampleInterval.total_seconds() * 1e9:
+            return
+
+        kSample = self.__delivered * 1e9 / kElapsedNs
+        self.__delivered = 0
+        self.__sample_ns = now_ns
+
+        # keep max of the samples, forget it after the window
+        if self.__estimate is None or self.__isExpired(now_ns) or kSample >= self.__estimate:
+            self.__estimate = kSample
+            self.__estimate_ns = now_ns
@@ -0,0 +1,105 @@
+import argparse
+import os
+import subprocess
+import time
+
+from testable_thread import TestableThread
+
+from globals import Globals
+from network import generate_port, setup_netem
+from pacer import Pacer
+from protocol import MyTCPProtocol
+
+
+class CountingProtocol(MyTCPProtocol):
+    """
+        Protocol that counts sent datagrams
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.datagrams_sent = 0
+
+    def sendto(self, data):
+        self.datagrams_sent += 1
+        return super().sendto(data)
+
+
+def run_transfer(msg_size, paced, rate):
+    """
+        Send `msg_size` bytes in one direction
+
+        `msg_size`: (int) amount of bytes to send
+        `paced`: (bool) whether to pace the sender
+        `rate`: (int) max pacing rate in bytes per second (None to pace by estimate only)
+
+        `return`: (tuple[float, int, int]) elapsed seconds, datagrams sent and
+            datagrams needed without loss
+    """
+
+    a_addr = ('127.0.0.1', generate_port())
+    b_addr = ('127.0.0.1', generate_port())
+
+    a = CountingProtocol(local_addr=a_addr, remote_addr=b_addr)
+    b = MyTCPProtocol(local_addr=b_addr, remote_addr=a_addr)
+
+    a.pacer = Pacer(rate=rate, enabled=paced)
+
+    msg = os.urandom(msg_size)
+
+    receiver = TestableThread(target=lambda: b.recv(msg_size))
+    receiver.daemon = True
+    receiver.start()
+
+    start = time.monotonic()
+    a.send(msg)
+    receiver.join()
+    elapsed = time.monotonic() - start
+
+    a.close()
+    b.close()
+
+    # sender gets only ACKs, so it sends only MSG batches
+    kSegments = -(-msg_size // Globals.kDataSize)
+    return elapsed, a.datagrams_sent, kSegments
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare paced and unpaced transfers under netem")
+    parser.add_argument("--size", type=int, default=8 * 2 ** 20, help="bytes per transfer")
+    parser.add_argument("--runs", type=int, default=3, help="transfers per mode")
+    parser.add_argument("--rate", type=float, default=None,
+                        help="max pacing rate in MiB/s (pace by estimate only by default)")
+    parser.add_argument("--loss", type=float, default=0.02, help="netem packet loss")
+    parser.add_argument("--duplicate", type=float, default=0.0, help="netem duplicate")
+    parser.add_argument("--reorder", type=float, default=0.0, help="netem reorder")
+    args = parser.parse_args()
+
+    # both modes run on the same configured loss
+    setup_netem(packet_loss=args.loss, duplicate=args.duplicate, reorder=args.reorder)
+
+    qdisc = subprocess.run(["tc", "qdisc", "show", "dev", "lo"], capture_output=True, text=True)
+    if "netem" not in qdisc.stdout:
+        print("WARNING: netem is not set up on lo, results show loopback buffer overflow only")
+
+    kRate = None if args.rate is None else int(args.rate * 2 ** 20)
+    results = {False: [0, 0, 0], True: [0, 0, 0]}
+
+    # alternate modes, so both see the same conditions
+    for _ in range(args.runs):
+        for paced in (False, True):
+            for i, value in enumerate(run_transfer(args.size, paced, kRate)):
+                results[paced][i] += value
+
+    for paced, (elapsed, sent, segments) in results.items():
+        kMode = "paced" if paced else "unpaced"
+        kLoss = (sent - segments) / sent
+        kGoodput = args.size * args.runs / elapsed / 2 ** 20
+
+        print(f"{kMode:>8}: goodput {kGoodput:8.2f} MiB/s, "
+              f"retransmitted {kLoss * 100:6.2f}% of {sent} datagrams "
+              f"(configured loss {args.loss * 100:.2f}%)")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,7 @@
 from batcher import Batch
 from globals import Globals
 from logger import Logger
+from pacer import Pacer
 import queue
 import socket
 
@@ -46,6 +47,14 @@ class MyTCPProtocol(UDPBasedProtocol):
         
         # buffer for received data
         self.recv_buffer = b""
+        # buffer for data accepted in non-blocking mode, but not sent yet
+        self.send_buffer = b""
+
+        # is the protocol in blocking mode?
+        self.blocking = True
+
+        # pacer for sent batches
+        self.pacer = Pacer()
 
         self.logger = Logger("log.txt")
 
@@ -104,7 +113,7 @@ class MyTCPProtocol(UDPBasedProtocol):
 
         try:
             bytes_sent = self.sendto(batch.encode()) - Globals.kHeaderSize
-        except TimeoutError:
+        except (TimeoutError, BlockingIOError):
             bytes_sent = 0
         except Exception as e:
             raise e
@@ -120,6 +129,9 @@ class MyTCPProtocol(UDPBasedProtocol):
 
         # no need to receive ACK on ACK
         if "ACK" not in flags:
+            if bytes_sent > 0:
+                self.pacer.consume(bytes_sent + Globals.kHeaderSize)
+
             batch.prepareForResend()
             self.ack_queue.put(batch, block=False)
 
@@ -145,10 +157,16 @@ class MyTCPProtocol(UDPBasedProtocol):
         return bytes_sent
 
     def __wait_for_batch(self):
+        """
+            Wait for a batch and process it
+
+            `return`: (bool) True if a batch was received
+        """
+
         try:
             response = Batch.decode(self.recvfrom(Globals.kBatchSize))
-        except TimeoutError:
-            return
+        except (TimeoutError, BlockingIOError):
+            return False
         except Exception as e:
             raise e
 
@@ -185,12 +203,15 @@ class MyTCPProtocol(UDPBasedProtocol):
         # if we got response batch with greater ack_num
         # update last acknowledged number
         if response.ack_num > self.ack_num:
+            self.pacer.onAck(response.ack_num - self.ack_num, self.seq_num - self.ack_num)
             self.ack_num = response.ack_num
             
             # pop all acknowledged batches
             while not self.ack_queue.empty() and self.__ack_front().seq_num < self.ack_num:
                 self.ack_queue.get(block=False)
 
+        return True
+
     def __resend_first(self):
         """
             Resend the first batch in the acknoledgement queue
@@ -202,35 +223,172 @@ class MyTCPProtocol(UDPBasedProtocol):
             not self.__ack_front().needsToBeResent():
             return
 
+        # resend later, not to exceed pacing rate
+        if self.pacer.delay(len(self.__ack_front().data) + Globals.kHeaderSize) > 0:
+            return
+
         try:
             self.__send_batch(self.ack_queue.get(block=False))
         except Exception as e:
             raise e
 
+    def __transmit(self):
+        """
+            Send all data from the send buffer
+        """
+
+        while self.send_buffer:
+            kDataSize = min(len(self.send_buffer), Globals.kDataSize)
+
+            # send the rest on the next pump
+            if self.pacer.delay(kDataSize + Globals.kHeaderSize) > 0:
+                break
+
+            batch = Batch(self.seq_num, self.received_bytes_amt,
+                          self.send_buffer[:kDataSize], "MSG")
+            self.send_buffer = self.send_buffer[len(batch.data):]
+
+            # batch is already in the acknoledgement queue,
+            # it will be resent later, so just keep seq_num consistent
+            if self.__send_batch(batch) == 0:
+                self.seq_num += len(batch.data)
+                break
+
+        if not self.send_buffer:
+            self.pacer.markAppLimited()
+
+    def __send_space(self):
+        """
+            Get free space of the send buffer
+
+            `return`: (int) amount of bytes that can be accepted by send
+        """
+
+        kUsed = len(self.send_buffer) + self.seq_num - self.ack_num
+        return max(Globals.kSendBufferSize - kUsed, 0)
+
+    def setblocking(self, flag: bool):
+        """
+            Set blocking or non-blocking mode
+
+            `flag`: (bool) True for blocking mode
+        """
+
+        self.blocking = flag
+
+        if flag:
+            self.udp_socket.settimeout(Globals.kTimeout.total_seconds())
+        else:
+            self.udp_socket.setblocking(False)
+
+    def fileno(self):
+        """
+            Get file descriptor of the underlying socket (for selectors)
+
+            `return`: (int) file descriptor
+        """
+
+        return self.udp_socket.fileno()
+
+    def readable(self):
+        """
+            Check if recv will return data without blocking
+
+            `return`: (bool) True if there is received data
+        """
+
+        return len(self.recv_buffer) > 0
+
+    def writable(self):
+        """
+            Check if send will accept data without blocking
+
+            `return`: (bool) True if there is free space in the send buffer
+        """
+
+        return self.__send_space() > 0
+
+    def next_send_timeout(self):
+        """
+            Get time until pacing allows pump() to send buffered data
+
+            `return`: (float) time in seconds (None if there is no buffered data)
+        """
+
+        if not self.send_buffer:
+            return None
+
+        return self.pacer.delay(min(len(self.send_buffer), Globals.kDataSize) + Globals.kHeaderSize)
+
+    def pump(self):
+        """
+            Make one step of the protocol: process all received batches,
+            resend expired batch and send buffered data. In non-blocking mode
+            should be called when fileno() is ready for reading, when
+            next_send_timeout() expires and at least every Globals.kTimeout
+
+            `return`: (int) number of received batches
+        """
+
+        received_amt = 0
+        while self.__wait_for_batch():
+            received_amt += 1
+
+        self.__resend_first()
+        self.__transmit()
+
+        return received_amt
+
     def send(self, data: bytes):
         if Globals.log:
             self.logger.log(f"SEND: Sending {data[:Globals.kLogMaxSize]}")
 
+        if not self.blocking:
+            # free space acknowledged by the other side
+            self.pump()
+
+            kSpace = self.__send_space()
+            if kSpace == 0 and len(data) > 0:
+                raise BlockingIOError("send buffer is full")
+
+            self.send_buffer += data[:kSpace]
+            self.__transmit()
+
+            return min(kSpace, len(data))
+
         kInputSize = len(data)
         bytes_sent = 0
 
         # while we have not sent all batches or
         # there are sent and not acknowledged batches
-        while bytes_sent != kInputSize or self.ack_num < self.seq_num:
+        while self.send_buffer or bytes_sent != kInputSize or self.ack_num < self.seq_num:
+            # retransmissions go first, not to wait behind new data for pacing
+            try:
+                self.__resend_first()
+            except Exception as e:
+                raise e
+
+            # send data left from non-blocking mode first
+            if self.send_buffer:
+                self.__transmit()
             # if we have not sent all batches
-            if bytes_sent < kInputSize:
+            elif bytes_sent < kInputSize:
                 # make batch to send
                 kEndIdx = min(bytes_sent + Globals.kDataSize, kInputSize)
                 kBatchToSend = Batch(self.seq_num, self.received_bytes_amt, data[bytes_sent:kEndIdx], "MSG")
 
+                # spread batches over time instead of sending a burst
+                self.pacer.wait(kEndIdx - bytes_sent + Globals.kHeaderSize)
+
                 # send the batch
                 bytes_sent += self.__send_batch(kBatchToSend)
+            # only waiting for ACKs
+            else:
+                self.pacer.markAppLimited()
 
             try:
                 # try to receive an ACK (or message)
                 self.__wait_for_batch()
-                # try to resend first unacked batch
-                self.__resend_first()
             except Exception as e:
                 raise e
 
@@ -240,6 +398,17 @@ class MyTCPProtocol(UDPBasedProtocol):
         if Globals.log:
             self.logger.log(f"RECV: Receiving {n} bytes")
 
+        if not self.blocking:
+            self.pump()
+
+            if not self.recv_buffer and n > 0:
+                raise BlockingIOError("no data available")
+
+            received = self.recv_buffer[:n]
+            self.recv_buffer = self.recv_buffer[n:]
+
+            return received
+
         # get data from receive buffer
         end_idx = min(n, len(self.recv_buffer))
         received = self.recv_buffer[:end_idx]
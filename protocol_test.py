@@ -1,23 +1,16 @@
 import os
-import random
+import selectors
+import time
 
 import pytest
 from testable_thread import TestableThread
 
+from globals import Globals
+from network import generate_port, setup_netem
+from pacer import Pacer
 from protocol import MyTCPProtocol
-from servers import EchoClient, EchoServer, ParallelClientServer
-
-used_ports = {}
-
-
-def generate_port():
-    while True:
-        port = random.randrange(25000, 30000)
-        if port not in used_ports:
-            break
-    used_ports[port] = True
-    return port
-
+from servers import EchoClient, EchoServer, ParallelClientServer, \
+    NonBlockingEchoClient, NonBlockingEchoServer
 
 def run_test(client_class, server_class, iterations, msg_size=None):
     a_addr = ('127.0.0.1', generate_port())
@@ -44,19 +37,54 @@ def run_test(client_class, server_class, iterations, msg_size=None):
     b.close()
 
 
-current_netem_state = None
+def run_multiplexed_test(connections, iterations, msg_size):
+    selector = selectors.DefaultSelector()
+    sockets = []
+    peers = []
+
+    for _ in range(connections):
+        a_addr = ('127.0.0.1', generate_port())
+        b_addr = ('127.0.0.1', generate_port())
+
+        a = MyTCPProtocol(local_addr=a_addr, remote_addr=b_addr)
+        b = MyTCPProtocol(local_addr=b_addr, remote_addr=a_addr)
+
+        for socket, peer_class in ((a, NonBlockingEchoClient), (b, NonBlockingEchoServer)):
+            socket.setblocking(False)
+            peer = peer_class(socket, iterations=iterations, msg_size=msg_size)
+            selector.register(socket, selectors.EVENT_READ, peer)
+            sockets.append(socket)
+            peers.append(peer)
+
+    # kick off the clients, everything else is driven by the selector
+    for peer in peers:
+        peer.step()
 
+    kTick = Globals.kTimeout.total_seconds()
+    next_tick = time.monotonic() + kTick
 
-def setup_netem(packet_loss, duplicate, reorder):
-    global current_netem_state
-    if current_netem_state == (packet_loss, duplicate, reorder):
-        return
-    current_netem_state = (packet_loss, duplicate, reorder)
-    netem_cmd = f"tc qdisc replace dev lo root netem loss {packet_loss * 100}% duplicate {duplicate * 100}%"
-    if reorder > 0:
-        netem_cmd += f" reorder {100 - reorder}% delay 10ms"
+    while not all(peer.done for peer in peers):
+        # wake up when pacing allows someone to send buffered data
+        send_timeouts = [socket.next_send_timeout() for socket in sockets]
+        timeout = min([next_tick - time.monotonic()] +
+                      [send_timeout for send_timeout in send_timeouts if send_timeout is not None])
 
-    os.system(netem_cmd)
+        ready = selector.select(timeout=max(timeout, 0))
+        ready_sockets = {key.fileobj for key, _ in ready}
+
+        # pump everyone from time to time to resend lost batches
+        is_tick = time.monotonic() >= next_tick
+        if is_tick:
+            next_tick = time.monotonic() + kTick
+
+        for socket, peer in zip(sockets, peers):
+            if is_tick or socket in ready_sockets or socket.next_send_timeout() == 0:
+                socket.pump()
+            peer.step()
+
+    selector.close()
+    for socket in sockets:
+        socket.close()
 
 
 # @pytest.mark.parametrize("iterations", [10, 100, 1000])
@@ -102,8 +130,159 @@ def setup_netem(packet_loss, duplicate, reorder):
 #     setup_netem(packet_loss=0.0, duplicate=0.0, reorder=0.0)
 #     run_test(ParallelClientServer, ParallelClientServer, iterations=iterations)
 
+@pytest.mark.parametrize("connections", [1, 100])
+@pytest.mark.timeout(60)
+def test_multiplexed(connections):
+    setup_netem(packet_loss=0.02, duplicate=0.02, reorder=0.01)
+    # more than fits into the send buffer, so send returns partial counts
+    run_multiplexed_test(connections, iterations=20, msg_size=60_000)
+
+@pytest.mark.timeout(60)
+def test_multiplexed_paced(monkeypatch):
+    setup_netem(packet_loss=0.02, duplicate=0.02, reorder=0.01)
+    monkeypatch.setattr(Globals, "kPacing", True)
+    run_multiplexed_test(10, iterations=20, msg_size=60_000)
+
+def test_nonblocking_would_block():
+    a_addr = ('127.0.0.1', generate_port())
+    b_addr = ('127.0.0.1', generate_port())
+
+    # b never pumps, so nothing sent by a is acknowledged
+    a = MyTCPProtocol(local_addr=a_addr, remote_addr=b_addr)
+    b = MyTCPProtocol(local_addr=b_addr, remote_addr=a_addr)
+    a.setblocking(False)
+
+    with pytest.raises(BlockingIOError):
+        a.recv(10)
+
+    msg = os.urandom(Globals.kSendBufferSize + 1)
+    assert a.send(msg) == Globals.kSendBufferSize
+    assert not a.writable()
+
+    with pytest.raises(BlockingIOError):
+        a.send(msg[-1:])
+
+    a.close()
+    b.close()
+
 @pytest.mark.parametrize("iterations", [50_000])
 @pytest.mark.timeout(60)
 def test_perfomance(iterations):
     setup_netem(packet_loss=0.02, duplicate=0.02, reorder=0.01)
     run_test(EchoClient, EchoServer, iterations=iterations, msg_size=10)
+
+
+class FakeClock:
+    def __init__(self):
+        self.now_ns = 0
+
+    def __call__(self):
+        return self.now_ns
+
+    def advance(self, seconds):
+        self.now_ns += int(seconds * 1e9)
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake_clock = FakeClock()
+    monkeypatch.setattr("pacer.time.monotonic_ns", fake_clock)
+    return fake_clock
+
+
+def test_pacer_disabled():
+    assert Pacer(rate=10 ** 6).getRate() is None
+    assert Pacer(rate=10 ** 6).delay(10 ** 9) == 0
+
+def test_pacer_delay_is_query(clock):
+    pacer = Pacer(rate=10 ** 6, burst=100_000, enabled=True)
+    pacer.consume(200_000)
+
+    assert pacer.delay(100_000) == pytest.approx(0.2)
+    assert pacer.delay(100_000) == pytest.approx(0.2)
+
+def test_pacer_refill_capped_by_burst(clock):
+    kRate = 10 ** 6
+    pacer = Pacer(rate=kRate, burst=100_000, enabled=True)
+    pacer.consume(100_000)
+
+    # much longer than needed to refill the bucket
+    clock.advance(10)
+    assert pacer.delay(100_000) == 0
+
+    # only `burst` tokens were added, so the next burst has to wait
+    pacer.consume(100_000)
+    assert pacer.delay(100_000) == pytest.approx(100_000 / kRate)
+
+def test_pacer_debt_and_delay(clock):
+    kRate = 10 ** 6
+    kQuantumSize = kRate * Globals.kPacingQuantum.total_seconds()
+    pacer = Pacer(rate=kRate, burst=100_000, enabled=True)
+
+    # bucket is full, no need to wait
+    assert pacer.delay(100_000) == 0
+
+    # bucket may go into debt
+    pacer.consume(100_000 + kQuantumSize)
+    assert pacer.delay(100_000) == pytest.approx((100_000 + kQuantumSize) / kRate)
+
+    # deficit within the quantum is not waited for
+    clock.advance(kQuantumSize / kRate)
+    assert pacer.delay(kQuantumSize) == 0
+
+    # otherwise wait for deficit / rate
+    assert pacer.delay(2 * kQuantumSize) == pytest.approx(2 * kQuantumSize / kRate)
+
+def test_pacer_estimate(clock):
+    kRate = 10 ** 9
+    kInterval = Globals.kPacingSampleInterval.total_seconds()
+    pacer = Pacer(rate=kRate, burst=Globals.kPacingBurst, enabled=True)
+
+    # samples with low amount of data in flight are dropped
+    clock.advance(kInterval)
+    pacer.onAck(10 ** 6, Globals.kPacingMinInFlight - 1)
+    assert pacer.getRate() == kRate
+
+    # sample of 100 MB/s
+    pacer.onAck(0, Globals.kPacingMinInFlight)
+    clock.advance(kInterval)
+    pacer.onAck(int(10 ** 8 * kInterval), Globals.kPacingMinInFlight)
+    assert pacer.getRate() == pytest.approx(Globals.kPacingGain * 10 ** 8)
+
+    # lower sample does not replace the max
+    clock.advance(kInterval)
+    pacer.onAck(int(10 ** 7 * kInterval), Globals.kPacingMinInFlight)
+    assert pacer.getRate() == pytest.approx(Globals.kPacingGain * 10 ** 8)
+
+    # max is forgotten after the window
+    clock.advance(Globals.kPacingWindow.total_seconds())
+    assert pacer.getRate() == kRate
+
+def test_pacer_estimate_grows_while_paced(clock):
+    kSegmentSize = 10_000
+    kInterval = Globals.kPacingSampleInterval.total_seconds()
+    # no cap, pace by the estimate only
+    pacer = Pacer(burst=kSegmentSize, enabled=True)
+    assert pacer.getRate() is None
+
+    # first sample of 10 MB/s is taken while not paced
+    pacer.onAck(0, Globals.kPacingMinInFlight)
+    clock.advance(kInterval)
+    pacer.onAck(int(10 ** 7 * kInterval), Globals.kPacingMinInFlight)
+    assert pacer.getRate() == pytest.approx(Globals.kPacingGain * 10 ** 7)
+
+    # send segments as fast as the pacer allows and ack them at once
+    for _ in range(3):
+        kRate = pacer.getRate()
+
+        # one sample at the current rate
+        pacer.onAck(0, Globals.kPacingMinInFlight)
+        kStartNs = clock.now_ns
+        while clock.now_ns - kStartNs < kInterval * 1e9:
+            kDelay = pacer.delay(kSegmentSize)
+            clock.advance(kDelay if kDelay > 0 else kSegmentSize / kRate)
+            pacer.consume(kSegmentSize)
+            pacer.onAck(kSegmentSize, Globals.kPacingMinInFlight)
+
+        # paced sample is recorded and the rate grows by the gain
+        assert pacer.getRate() == pytest.approx(Globals.kPacingGain * kRate, rel=0.1)
@@ -41,3 +41,39 @@ class ParallelClientServer(Base):
             assert i_recv == i
  
  
+class NonBlockingEchoServer(Base):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.done = False
+        self.pending = b""
+        self.echoed = 0
+
+    def step(self):
+        if self.socket.readable():
+            self.pending += self.socket.recv(self.msg_size * self.iterations)
+
+        if self.pending and self.socket.writable():
+            n = self.socket.send(self.pending)
+            self.pending = self.pending[n:]
+            self.echoed += n
+
+        self.done = self.echoed == self.msg_size * self.iterations
+
+
+class NonBlockingEchoClient(Base):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.done = False
+        self.sent_amt = 0
+        self.received = b""
+        self.msg = os.urandom(self.msg_size * self.iterations)
+
+    def step(self):
+        if self.sent_amt < len(self.msg) and self.socket.writable():
+            self.sent_amt += self.socket.send(self.msg[self.sent_amt:])
+
+        if self.socket.readable():
+            self.received += self.socket.recv(len(self.msg))
+            assert self.msg.startswith(self.received)
+
+        self.done = self.received == self.msg